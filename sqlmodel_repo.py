@@ -1,7 +1,20 @@
-from contextlib import contextmanager
-from typing import Optional
-
-from sqlmodel import Session, SQLModel, select, delete, update, func
+import hashlib
+import time
+from functools import lru_cache
+from itertools import islice
+from typing import Iterable, Optional
+
+from sqlalchemy import inspect, tuple_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import Row, make_url
+from sqlalchemy.orm import (
+    make_transient_to_detached, raiseload, selectinload, sessionmaker
+)
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.pool import QueuePool
+from sqlmodel import (
+    Session, SQLModel, select, delete, update, func, create_engine
+)
 
 try:
     from fastapi.exceptions import HTTPException
@@ -9,32 +22,128 @@ except Exception:
     pass
 
 
-@contextmanager
-def reuse_session_or_new(db_engine=None, session: Optional[Session] = None):
+# Dialect-specific INSERT constructs that support upserts.
+_UPSERT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+    'mysql': mysql.insert,
+}
+
+
+def create_repo_engine(url, **kwargs):
+    """Create an engine with pool settings suited to many short repo calls.
+
+    For queue-based pools, connections are reused LIFO so the most recently
+    used (warm) connection is handed out first and idle overflow connections
+    can time out. Stale connections are pinged and recycled. Any of these
+    can be overridden through ``kwargs``.
+    """
+    url = make_url(url)
+    poolclass = kwargs.get('poolclass') or (
+        url.get_dialect().get_pool_class(url)
+    )
+    if issubclass(poolclass, QueuePool):
+        kwargs.setdefault('pool_use_lifo', True)
+        kwargs.setdefault('pool_pre_ping', True)
+        kwargs.setdefault('pool_recycle', 3600)
+    return create_engine(url, **kwargs)
+
+
+@lru_cache(maxsize=None)
+def _model_columns(model) -> dict:
+    """Map column attribute names to the model's instrumented attributes."""
+    return {
+        name: getattr(model, name)
+        for name in inspect(model).column_attrs.keys()
+    }
+
+
+@lru_cache(maxsize=None)
+def _model_primary_key(model) -> tuple:
+    """Return the model's primary key attribute and its attribute name.
+
+    Only needed by lookups and writes by id, which match on a single
+    column, so composite keys are rejected here rather than per repo.
+    """
+    mapper = inspect(model)
+    if len(mapper.primary_key) > 1:
+        raise ValueError(
+            f"Lookup by id needs a single-column primary key, "
+            f"{model.__name__} has a composite one."
+        )
+    name = mapper.get_property_by_column(mapper.primary_key[0]).key
+    return getattr(model, name), name
+
+
+@lru_cache(maxsize=None)
+def _model_onupdates(model) -> Optional[dict]:
+    """Map attribute names to their ``Column.onupdate`` values.
+
+    Upserts bypass the ORM, so these have to be put in the SET clause by
+    hand. Returns None when a value is a Python callable, which only the
+    ORM can evaluate.
+    """
+    onupdates = {}
+    for prop in inspect(model).column_attrs:
+        onupdate = prop.columns[0].onupdate
+        if onupdate is None:
+            continue
+        if onupdate.is_callable:
+            return None
+        onupdates[prop.key] = onupdate.arg
+    return onupdates
+
+
+@lru_cache(maxsize=None)
+def _model_statements(model) -> tuple:
+    """Build the model's invariant statements once.
+
+    Returns select all, count and insert statements.
+    """
+    return (
+        select(model),
+        select(func.count()).select_from(model),
+        model.__table__.insert(),
+    )
+
+
+# Factory for sessions opened by the repo. Objects outlive these sessions,
+# so their loaded state is kept after commit instead of being expired.
+# The engine is bound per call, so no reference to it is kept here.
+_session_factory = sessionmaker(class_=Session, expire_on_commit=False)
+
+
+class reuse_session_or_new:
     """
     Context manager to wrap session reuse or creation logic.
 
+    A plain class with ``__slots__`` rather than a generator-based
+    ``@contextmanager``, as it wraps every repo call.
+
     :param session: An existing session to reuse. If None,
         a new session is created.
     :param db_engine: The database engine to use if creating a new session.
     """
-    should_close = False
-    try:
+    __slots__ = ('session', 'should_close')
+
+    def __init__(self, db_engine=None, session: Optional[Session] = None):
         # If session is None, create a new session using the provided db_engine
+        self.should_close = session is None
         if session is None:
             if db_engine is None:
                 raise ValueError(
                     "No session and no db_engine provided to create a session."
                 )
-            session = Session(db_engine)
-            should_close = True
+            session = _session_factory(bind=db_engine)
+        self.session = session
 
-        # Yield the session for use in the context block
-        yield session
-    finally:
+    def __enter__(self) -> Session:
+        return self.session
+
+    def __exit__(self, exc_type, exc_value, traceback):
         # Close the session if it was created inside this context manager
-        if should_close:
-            session.close()
+        if self.should_close:
+            self.session.close()
 
 
 class SQLModelRepo:
@@ -54,78 +163,228 @@ class SQLModelRepo:
             users_repo.get_by_id(1)
         """
         self.model = model
+        self._cols = _model_columns(model)
+        (
+            self._stmt_all, self._stmt_count, self._stmt_insert
+        ) = _model_statements(model)
         self._init_stmt = init_stmt
         self.db_engine = db_engine
         self.session = session
 
+    @property
+    def _pk_col(self):
+        return _model_primary_key(self.model)[0]
+
+    @property
+    def _pk_name(self):
+        return _model_primary_key(self.model)[1]
+
     def __call__(self, session):
         new_repo = SQLModelRepo(model=self.model, db_engine=self.db_engine)
         new_repo.session = session
         return new_repo
 
-    def create(self, **kwargs):
-        """Create a new record and save to the database."""
+    def create(self, refresh: bool = False, **kwargs):
+        """Create a new record and save to the database.
+
+        Args:
+            refresh: Reload the record after commit, e.g. to fetch
+                server-generated defaults. The primary key is populated
+                either way.
+        """
         instance = self.model(**kwargs)
         with reuse_session_or_new(self.db_engine, self.session) as session:
             session.add(instance)
             session.commit()
-            session.refresh(instance)
+            if refresh:
+                session.refresh(instance)
         return instance
 
+    def insert(self, **kwargs):
+        """Insert a record without building a model instance.
+
+        A lighter alternative to ``create`` for write-heavy paths: the row
+        goes straight to a table INSERT, skipping model validation and the
+        ORM unit of work. Column defaults still apply, unknown column
+        names raise ``CompileError``.
+
+        Returns:
+            The primary key of the new record, a tuple for composite keys.
+        """
+        with reuse_session_or_new(self.db_engine, self.session) as session:
+            # values() raises on names that aren't columns
+            result = session.execute(self._stmt_insert.values(**kwargs))
+            session.commit()
+        pk = result.inserted_primary_key
+        return pk[0] if len(pk) == 1 else tuple(pk)
+
+    def bulk_create(self, rows: Iterable[dict], batch_size: int = 1000):
+        """Insert many records in batches using a single commit.
+
+        Args:
+            rows: Iterable of dicts mapping column names to values.
+            batch_size: Number of rows sent per executemany batch.
+        """
+        rows = iter(rows)
+        with reuse_session_or_new(self.db_engine, self.session) as session:
+            while chunk := list(islice(rows, batch_size)):
+                session.bulk_insert_mappings(self.model, chunk)
+            session.commit()
+
     def get_by_id(self, id, *fields):
         """Fetch an object by its primary key."""
-        stmt = self.init_stmt(*fields)
+        pk_col = self._pk_col
+        if id is None:
+            return None
         with reuse_session_or_new(self.db_engine, self.session) as session:
-            return session.exec(
-                stmt.where(
-                    getattr(self.model, 'id') == id
-                )
-            ).first()
+            if self._init_stmt is None and not fields:
+                # Checks the identity map first, then loads by primary key
+                return session.get(self.model, id)
+            stmt = self.init_stmt(*fields)
+            return self._exec(session, stmt.where(pk_col == id)).first()
+
+    def save(self, instance, refresh: bool = False):
+        """Save the current object (instance) to the database.
 
-    def save(self, instance):
-        """Save the current object (instance) to the database."""
+        Args:
+            refresh: Reload the record after commit.
+        """
         with reuse_session_or_new(self.db_engine, self.session) as session:
             session.add(instance)
             session.commit()
-            session.refresh(instance)
+            if refresh:
+                session.refresh(instance)
 
     def save_or_update(self, instance):
-        """Save the current object (instance) to the database."""
+        """Insert the instance, or update the record with the same id.
+
+        On PostgreSQL, SQLite and MySQL a record with a primary key is
+        saved with a single upsert statement writing only the fields set on
+        the instance. A new instance passed in becomes the saved record,
+        unless the session already holds that record: then the held object
+        is updated and returned.
+
+        Returns:
+            The saved record.
+        """
+        pk = getattr(instance, self._pk_name)
         with reuse_session_or_new(self.db_engine, self.session) as session:
-            existing_obj = session.exec(
-                select(self.model).where(
-                    self.model.id == instance.id
-                )
-            ).first()
-            if existing_obj:
-                for k, v in instance.model_dump().items():
-                    setattr(existing_obj, k, v)
-                    session.add(existing_obj)
-                    instance = existing_obj
-            else:
+            if pk is None:
+                # Nothing to conflict with, a plain ORM insert will do
                 session.add(instance)
+                session.commit()
+                return instance
+            dialect = session.get_bind().dialect
+            upsert_stmt = self._upsert_stmt(dialect, instance)
+            if upsert_stmt is None:
+                return self._save_or_update_existing(session, instance)
+            held = (
+                session.identity_key(self.model, pk) in session.identity_map
+            )
+            if dialect.insert_returning:
+                saved = session.scalars(
+                    upsert_stmt.returning(self.model),
+                    execution_options={'populate_existing': True}
+                ).one()
+            else:
+                session.execute(upsert_stmt)
+                saved = session.get(self.model, pk, populate_existing=True)
             session.commit()
-            session.refresh(instance)
+            if inspect(instance).transient and not held:
+                saved = self._adopt_saved(session, instance, saved)
+        return saved
+
+    def _adopt_saved(self, session, instance, saved):
+        """Turn a transient instance into the saved record it was upserted
+        as, so that later ``save``/``delete`` calls work on it."""
+        for name in self._cols:
+            set_committed_value(instance, name, getattr(saved, name))
+        make_transient_to_detached(instance)
+        if saved in session:
+            # Only created by the upsert above, nobody else refers to it
+            session.expunge(saved)
+            session.add(instance)
+        return instance
+
+    def _upsert_stmt(self, dialect, instance):
+        insert = _UPSERT_INSERTS.get(dialect.name)
+        onupdates = _model_onupdates(self.model)
+        if insert is None or onupdates is None:
+            return None
+        # The full row is needed for the INSERT (NOT NULL is checked before
+        # the conflict), but only fields set on the instance are updated.
+        row = {
+            k: v for k, v in instance.model_dump().items() if k in self._cols
+        }
+        changes = {
+            k: row[k] for k in instance.model_fields_set
+            if k in row and k != self._pk_name
+        }
+        if not changes:
+            return None
+        changes = {**onupdates, **changes}
+        stmt = insert(self.model).values(**row)
+        if dialect.name == 'mysql':
+            return stmt.on_duplicate_key_update(**changes)
+        return stmt.on_conflict_do_update(
+            index_elements=[self._pk_col], set_=changes
+        )
+
+    def _save_or_update_existing(self, session, instance):
+        existing_obj = session.exec(
+            select(self.model).where(
+                self._pk_col == getattr(instance, self._pk_name)
+            )
+        ).first()
+        if existing_obj:
+            changes = instance.model_dump(
+                exclude={self._pk_name}, exclude_unset=True
+            )
+            for k, v in changes.items():
+                setattr(existing_obj, k, v)
+            session.add(existing_obj)
+            instance = existing_obj
+        else:
+            session.add(instance)
+        session.commit()
+        session.refresh(instance)
+        return instance
 
     def update(self, id, **kwargs):
-        """Record partial update."""
+        """Record partial update.
+
+        Values are part of the statement, so the session can apply them to
+        loaded objects. SQLAlchemy caches the compiled SQL for each set of
+        updated columns.
+        """
+        update_stmt = update(self.model).where(
+            self._pk_col == id
+        ).values(**kwargs)
         with reuse_session_or_new(self.db_engine, self.session) as session:
-            update_stmt = update(self.model).where(
-                self.model.id == id
-            ).values(**kwargs)
             session.execute(update_stmt)
             session.commit()
 
+    def bulk_update(self, rows: Iterable[dict], batch_size: int = 1000):
+        """Partial update of many records in batches using a single commit.
+
+        Args:
+            rows: Iterable of dicts, each holding the primary key and the
+                columns to update.
+            batch_size: Number of rows sent per executemany batch.
+        """
+        rows = iter(rows)
+        with reuse_session_or_new(self.db_engine, self.session) as session:
+            while chunk := list(islice(rows, batch_size)):
+                session.bulk_update_mappings(self.model, chunk)
+            session.commit()
+
     def update_all(self, **kwargs):
         """Partial update for all selected records."""
+        update_stmt = self._with_filter(update(self.model).values(**kwargs))
         with reuse_session_or_new(self.db_engine, self.session) as session:
-            if self._init_stmt:
-                update_stmt = update(self.model).where(
-                    self.init_stmt().whereclause
-                ).values(**kwargs)
-            else:
-                update_stmt = update(self.model).values(**kwargs)
-            session.execute(update_stmt)
+            session.execute(
+                update_stmt.execution_options(synchronize_session=False)
+            )
             session.commit()
 
     def delete(self, instance):
@@ -136,13 +395,8 @@ class SQLModelRepo:
 
     def delete_all(self):
         """Delete all records in query."""
+        delete_stmt = self._with_filter(delete(self.model))
         with reuse_session_or_new(self.db_engine, self.session) as session:
-            if self._init_stmt:
-                delete_stmt = delete(self.model).where(
-                    self.init_stmt().whereclause
-                )
-            else:
-                delete_stmt = delete(self.model)
             session.execute(delete_stmt)
             session.commit()
 
@@ -150,11 +404,7 @@ class SQLModelRepo:
         """Filter records based on provided conditions."""
         stmt = self.init_stmt(*_fields).where(
             *filters,
-            *[
-                getattr(self.model, k) == v
-                if isinstance(k, str) else k == v
-                for k, v in kwargs.items()
-            ]
+            *[self._attr(k) == v for k, v in kwargs.items()]
         )
         return SQLModelRepo(
             init_stmt=stmt,
@@ -163,93 +413,315 @@ class SQLModelRepo:
             session=self.session
         )
 
+    def options(self, *options) -> 'SQLModelRepo':
+        """Apply loader options, e.g. ``joinedload(User.groups)``.
+
+        Joined loads of collections are not supported by ``iter_all``.
+        """
+        return SQLModelRepo(
+            init_stmt=self.init_stmt().options(*options),
+            model=self.model,
+            db_engine=self.db_engine,
+            session=self.session
+        )
+
+    def with_related(self, *relationships: str) -> 'SQLModelRepo':
+        """Eager load relationships by name with a single IN query each."""
+        return self.options(*[
+            selectinload(getattr(self.model, name)) for name in relationships
+        ])
+
+    def strict_relations(self) -> 'SQLModelRepo':
+        """Raise on any lazy load instead of silently querying (N+1)."""
+        return self.options(raiseload('*'))
+
     def paginate(
         self,
         offset: int,
         limit: int,
         order_by: str,
-        desc: bool = False
+        desc: bool = False,
+        deferred_join: bool = False
     ) -> list:
-        """Paginate results"""
+        """Paginate results
+
+        Args:
+            deferred_join: Page over primary keys only and join back for the
+                full rows. Speeds up large offsets on wide tables.
+        """
         with reuse_session_or_new(self.db_engine, self.session) as session:
-            return self._paginate(session, offset, limit, order_by, desc)
+            return self._paginate(
+                session, offset, limit, order_by, desc, deferred_join
+            )
 
     def paginate_with_total(
         self,
         offset: int,
         limit: int,
         order_by: str,
-        desc: bool = False
+        desc: bool = False,
+        deferred_join: bool = False,
+        count_cache: Optional[dict] = None,
+        count_cache_ttl: float = 60
     ) -> (list, int):
         """Paginate results and fetch total count
 
+        Args:
+            deferred_join: See ``paginate``.
+            count_cache: Optional dict-like store for total counts, keyed by
+                the database and the count query. Pages of the same query
+                reuse the cached total instead of counting again. Expired
+                entries are dropped on a miss; for long-running apps pass a
+                bounded cache such as ``cachetools.TTLCache``.
+            count_cache_ttl: Seconds a cached count stays valid.
+
         Returns:
             tuple(list, int) - Items and total count.
         """
         with reuse_session_or_new(self.db_engine, self.session) as session:
-            count_stmt = select(func.count()).select_from(
-                self.init_stmt().subquery()
+            count = self._count(session, count_cache, count_cache_ttl)
+            results = self._paginate(
+                session, offset, limit, order_by, desc, deferred_join
             )
-            count = session.execute(count_stmt).scalar()
-            results = self._paginate(session, offset, limit, order_by, desc)
             return results, count
 
+    def paginate_after(
+        self,
+        cursor,
+        limit: int,
+        order_by: str | tuple[str, ...],
+        desc: bool = False
+    ) -> (list, object):
+        """Keyset pagination: fetch the page that follows ``cursor``.
+
+        Instead of skipping rows with OFFSET, the page starts with
+        ``WHERE order_by > :cursor``, which the database can answer with an
+        index seek however deep the page is.
+
+        Args:
+            cursor: Value of ``order_by`` on the last item of the previous
+                page, or None for the first page. A tuple when ``order_by``
+                is a tuple.
+            limit: Page size.
+            order_by: Column name, or a tuple of column names for a
+                composite key, e.g. ``('username', 'id')``. The key must be
+                unique for pages not to skip or repeat rows.
+            desc: Walk in descending order.
+
+        Returns:
+            tuple(list, cursor) - Items and the cursor for the next page
+            (None when the page is empty).
+        """
+        with reuse_session_or_new(self.db_engine, self.session) as session:
+            return self._paginate_after(
+                session, cursor, limit, order_by, desc
+            )
+
+    def _paginate_after(
+        self,
+        session,
+        cursor,
+        limit: int,
+        order_by: str | tuple[str, ...],
+        desc: bool = False
+    ) -> (list, object):
+        composite = not isinstance(order_by, str)
+        names = order_by if composite else (order_by,)
+        cols = [self._attr(name) for name in names]
+        stmt = self.init_stmt()
+        if cursor is not None:
+            key = tuple_(*cols) if composite else cols[0]
+            value = tuple_(*cursor) if composite else cursor
+            stmt = stmt.where(key < value if desc else key > value)
+        stmt = stmt.order_by(
+            *[col.desc() if desc else col for col in cols]
+        ).limit(limit)
+        items = self._exec(session, stmt).all()
+        if not items:
+            return items, None
+        last = items[-1]
+        if isinstance(last, (self.model, Row)):
+            values = {
+                name: getattr(last, name) for name in names
+                if hasattr(last, name)
+            }
+        else:
+            # A single selected column comes back as plain values
+            values = {stmt.selected_columns[0].key: last}
+        if missing := [name for name in names if name not in values]:
+            raise ValueError(
+                f"Cannot build a cursor, {', '.join(missing)} not selected."
+            )
+        next_cursor = tuple(values[name] for name in names)
+        return items, next_cursor if composite else next_cursor[0]
+
     def _paginate(
         self,
         session,
         offset: int,
         limit: int,
         order_by: str,
-        desc: bool = False
+        desc: bool = False,
+        deferred_join: bool = False
     ) -> list:
-        order_by = getattr(self.model, order_by)
+        order_by = self._attr(order_by)
         if desc:
-            order_by = getattr(order_by, 'desc')()
-        return session.exec(
-            self.init_stmt().order_by(order_by).offset(offset).limit(limit)
+            order_by = order_by.desc()
+        stmt = self.init_stmt()
+        if deferred_join:
+            # Skip over ids only (index-only scan) and fetch full rows
+            # just for the page.
+            page_ids = stmt.with_only_columns(
+                self._pk_col.label('pk'), maintain_column_froms=True
+            ).order_by(order_by).offset(offset).limit(limit).subquery()
+            return self._exec(
+                session,
+                stmt.join(page_ids, self._pk_col == page_ids.c.pk)
+                .order_by(order_by)
+            ).all()
+        return self._exec(
+            session, stmt.order_by(order_by).offset(offset).limit(limit)
         ).all()
 
+    @staticmethod
+    def _exec(session, stmt):
+        result = session.exec(stmt)
+        if stmt._with_options:
+            # Joined eager loads of collections repeat the parent rows
+            result = result.unique()
+        return result
+
     def all(self) -> list:
         """Get all results"""
         with reuse_session_or_new(self.db_engine, self.session) as session:
-            return session.exec(self.init_stmt()).all()
+            return self._exec(session, self.init_stmt()).all()
+
+    def values(self, *fields: str) -> list:
+        """Get only the given columns of all results.
+
+        Rows are returned as named tuples (``Row``), skipping ORM object
+        construction, e.g. ``users_repo.values('id', 'email')``.
+        """
+        stmt = self.init_stmt().with_only_columns(
+            *[self._attr(f) for f in fields], maintain_column_froms=True
+        )
+        with reuse_session_or_new(self.db_engine, self.session) as session:
+            return session.execute(stmt).all()
+
+    def iter_all(self, chunk: int = 1000):
+        """Iterate over all results, fetching ``chunk`` rows at a time.
+
+        Rows are streamed (server-side cursor where the driver supports it),
+        so memory use stays bounded by ``chunk``. The session is held open
+        until the iteration is finished or the generator is closed.
+        """
+        stmt = self.init_stmt().execution_options(yield_per=chunk)
+        with reuse_session_or_new(self.db_engine, self.session) as session:
+            yield from session.exec(stmt)
 
     def count(self):
         """Get total results count"""
         with reuse_session_or_new(self.db_engine, self.session) as session:
-            count_stmt = select(func.count()).select_from(
-                self.init_stmt().subquery()
-            )
+            return session.execute(self._count_stmt()).scalar()
+
+    def _count(self, session, count_cache=None, count_cache_ttl=60):
+        count_stmt = self._count_stmt()
+        if count_cache is None:
             return session.execute(count_stmt).scalar()
+        engine = session.get_bind().engine
+        compiled = count_stmt.compile(engine)
+        # Stable across processes, so the cache can be shared by workers
+        key = hashlib.sha256(
+            f'{engine.url}\n{compiled}\n{compiled.params!r}'.encode()
+        ).hexdigest()
+        now = time.time()
+        cached = count_cache.get(key)
+        if cached is not None and now - cached[0] < count_cache_ttl:
+            return cached[1]
+        for stale_key, (stamp, _) in list(count_cache.items()):
+            if now - stamp >= count_cache_ttl:
+                count_cache.pop(stale_key, None)
+        count = session.execute(count_stmt).scalar()
+        count_cache[key] = (now, count)
+        return count
+
+    def _count_stmt(self):
+        """Build ``SELECT count(*)`` for the current statement.
+
+        The count replaces the selected columns and drops ORDER BY, so the
+        database can count straight from the table (or a covering index).
+        Statements with GROUP BY, DISTINCT or LIMIT/OFFSET change the number
+        of rows and are wrapped in a subquery instead.
+        """
+        if self._init_stmt is None:
+            return self._stmt_count
+        stmt = self._init_stmt
+        if (
+            stmt._group_by_clauses
+            or stmt._distinct
+            or stmt._limit_clause is not None
+            or stmt._offset_clause is not None
+        ):
+            return select(func.count()).select_from(stmt.subquery())
+        return stmt.with_only_columns(
+            func.count(), maintain_column_froms=True
+        ).order_by(None)
 
     def first(self):
         with reuse_session_or_new(self.db_engine, self.session) as session:
-            return session.exec(self.init_stmt()).first()
+            return self._exec(session, self.init_stmt()).first()
 
     def get_or_404(self, id):
         if not (obj := self.get_by_id(id)):
-            raise HTTPException(
-                status_code=404,
-                detail=f'{self.model.__name__.title()} with id {id} not found'
-            )
+            self._raise_404(id)
         return obj
 
     def delete_or_404(self, id):
-        obj = self.get_or_404(id)
-        self.delete(obj)
+        self._execute_or_404(delete(self.model), id)
 
     def update_or_404(self, id, **kwargs):
-        if self.get_or_404(id):
-            self.update(id, **kwargs)
+        self._execute_or_404(update(self.model).values(**kwargs), id)
+
+    def _execute_or_404(self, stmt, id):
+        """Run UPDATE/DELETE for one record, 404 if no record matched."""
+        stmt = self._with_filter(stmt.where(self._pk_col == id))
+        with reuse_session_or_new(self.db_engine, self.session) as session:
+            if not session.execute(stmt).rowcount:
+                self._raise_404(id)
+            session.commit()
+
+    def _with_filter(self, stmt):
+        """Apply the repo's WHERE clause, if any, to an UPDATE/DELETE."""
+        if (
+            self._init_stmt is not None
+            and self._init_stmt.whereclause is not None
+        ):
+            return stmt.where(self._init_stmt.whereclause)
+        return stmt
+
+    def _raise_404(self, id):
+        raise HTTPException(
+            status_code=404,
+            detail=f'{self.model.__name__.title()} with id {id} not found'
+        )
+
+    def _attr(self, name):
+        """Model attribute by name; relationships and hybrids included."""
+        try:
+            return self._cols[name]
+        except KeyError:
+            return getattr(self.model, name)
 
     def _get_select_obj(self, fields=None):
         return (
             [self.model] if not fields
-            else [getattr(self.model, f) for f in fields]
+            else [self._attr(f) for f in fields]
         )
 
     def init_stmt(self, *fields):
         if self._init_stmt is not None:
             return self._init_stmt
+        elif not fields:
+            return self._stmt_all
         else:
             return select(*self._get_select_obj(fields))
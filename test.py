@@ -1,7 +1,15 @@
-from sqlalchemy import Column, JSON, cast, String
-from sqlmodel import SQLModel, Field, create_engine, Session
+import gc
+import warnings
+import weakref
+from datetime import datetime, timezone
 
-from sqlmodel_repo import SQLModelRepo
+import pytest
+from sqlalchemy import Column, JSON, cast, func, String
+from sqlalchemy.exc import CompileError, InvalidRequestError
+from sqlalchemy.orm import joinedload
+from sqlmodel import SQLModel, Field, Relationship, Session
+
+from sqlmodel_repo import SQLModelRepo, create_repo_engine
 
 
 class User(SQLModel, table=True):
@@ -11,8 +19,58 @@ class User(SQLModel, table=True):
     extra_metadata: dict = Field(sa_column=Column(JSON))
 
 
+class Team(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    name: str
+    members: list['Member'] = Relationship(back_populates='team')
+
+
+class Member(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    name: str
+    team_id: int | None = Field(default=None, foreign_key='team.id')
+    team: Team | None = Relationship(back_populates='members')
+
+
+class Setting(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    value: str
+
+
+class Note(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    text: str
+    revision: str | None = Field(
+        default=None, sa_column_kwargs={'onupdate': 'edited'}
+    )
+    edited_at: datetime | None = Field(
+        default=None, sa_column_kwargs={'onupdate': func.now()}
+    )
+
+
+class Stamp(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    text: str
+    edited_at: datetime | None = Field(
+        default=None,
+        sa_column_kwargs={'onupdate': lambda: datetime.now(timezone.utc)}
+    )
+
+
+class Code(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    pk: int
+    name: str
+
+
+class Pair(SQLModel, table=True):
+    a: int = Field(primary_key=True)
+    b: int = Field(primary_key=True)
+    value: str
+
+
 # Setup in-memory SQLite engine and metadata
-engine = create_engine("sqlite:///:memory:", echo=True)
+engine = create_repo_engine("sqlite:///:memory:", echo=True)
 SQLModel.metadata.create_all(engine)
 
 # Instantiate the repository with the User model and engine
@@ -23,11 +81,17 @@ def test_all():
     # Create a new user
     user1 = users_repo.create(username="john_doe", email="john@example.com")
 
+    assert user1.id is not None
+
     # Get user by ID
     fetched_user = users_repo.get_by_id(user1.id)
+    assert fetched_user.username == "john_doe"
 
     # Ensure a user that doesn't exist returns None
     assert users_repo.get_by_id(123) is None
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert users_repo.get_by_id(None) is None
 
     # Get all users
     all_users = users_repo.all()
@@ -35,7 +99,8 @@ def test_all():
 
     # Update fetched_user and save changes
     fetched_user.email = "new_email@example.com"
-    users_repo.save(fetched_user)
+    users_repo.save(fetched_user, refresh=True)
+    assert fetched_user.email == "new_email@example.com"
 
     # Create another user
     users_repo.create(username="joe", email="joe@example.com")
@@ -67,16 +132,25 @@ def test_all():
     ).all()
     assert users, "cannot find by metadata"
 
-    # Create 10 more users
-    for i in range(10):
-        users_repo.create(
-            username=f'user{i}',
-            email=f'user{i}@example.com',
-            extra_metadata={'i': i}
-        )
+    # Create 10 more users in batches
+    users_repo.bulk_create(
+        [
+            dict(
+                username=f'user{i}',
+                email=f'user{i}@example.com',
+                extra_metadata={'i': i}
+            )
+            for i in range(10)
+        ],
+        batch_size=4
+    )
 
     # Verify the total number of users
     assert len(users_repo.all()) == 12
+    assert sum(1 for _ in users_repo.iter_all(chunk=5)) == 12
+    rows = users_repo.filter(username='user3').values('id', 'email')
+    assert rows[0].email == 'user3@example.com'
+    assert len(rows[0]) == 2
 
     # Paginate the results (order by username in descending order)
     users, total_count = (
@@ -87,8 +161,39 @@ def test_all():
     assert total_count == 12
     assert users[0].username == 'user9'
 
+    # Cache total count between pages
+    count_cache = {}
+    _, total_count = users_repo.paginate_with_total(
+        0, 4, order_by='username', count_cache=count_cache
+    )
+    carl = users_repo.create(username="carl", email="carl@example.com")
+    _, cached_count = users_repo.paginate_with_total(
+        4, 4, order_by='username', count_cache=count_cache
+    )
+    assert cached_count == total_count == 12
+    assert all(isinstance(key, str) for key in count_cache)
+    # Another database with the same schema doesn't share counts
+    other_engine = create_repo_engine("sqlite://")
+    SQLModel.metadata.create_all(other_engine)
+    _, other_count = SQLModelRepo(
+        model=User, db_engine=other_engine
+    ).paginate_with_total(0, 4, order_by='username', count_cache=count_cache)
+    assert other_count == 0
+    _, fresh_count = users_repo.paginate_with_total(
+        4, 4, order_by='username',
+        count_cache=count_cache, count_cache_ttl=0
+    )
+    assert fresh_count == 13
+    # Expired entries are dropped, not only overwritten
+    assert len(count_cache) == 1
+    users_repo.delete(carl)
+
     assert users_repo.first()
     assert users_repo.count() == 12
+    assert users_repo.filter(User.username.startswith('user')).count() == 10
+    assert users_repo.filter(
+        _fields=('email',)
+    ).count() == 12
 
     # Paginate the results (order by username in ascending order)
     users, total_count = (
@@ -97,11 +202,83 @@ def test_all():
     )
     assert users[0].username == 'bob'
 
+    # Paginate using a deferred join
+    users = users_repo.filter(User.username.startswith('user')).paginate(
+        3, 4, order_by='username', desc=True, deferred_join=True
+    )
+    assert [u.username for u in users] == ['user6', 'user5', 'user4', 'user3']
+
+    # Keyset pagination
+    users, cursor = users_repo.paginate_after(None, 5, order_by='username')
+    assert users[0].username == 'bob'
+    users, cursor = users_repo.paginate_after(cursor, 5, order_by='username')
+    assert [u.username for u in users] == [f'user{i}' for i in range(3, 8)]
+    users, cursor = users_repo.paginate_after(
+        ('user5', 0), 3, order_by=('username', 'id'), desc=True
+    )
+    assert [u.username for u in users] == ['user4', 'user3', 'user2']
+    assert cursor == ('user2', users[-1].id)
+    names, cursor = users_repo.filter(
+        _fields=('username',)
+    ).paginate_after('user2', 2, order_by='username')
+    assert names == ['user3', 'user4'] and cursor == 'user4'
+    rows, cursor = users_repo.filter(
+        _fields=('id', 'username')
+    ).paginate_after(None, 2, order_by=('username', 'id'))
+    assert cursor == (rows[-1].username, rows[-1].id)
+    with pytest.raises(ValueError, match='email'):
+        users_repo.filter(_fields=('username',)).paginate_after(
+            None, 2, order_by='email'
+        )
+
+    # Update many users at once
+    synced = users_repo.filter(User.username.startswith('user')).all()
+    users_repo.bulk_update(
+        [dict(id=u.id, email=f'{u.username}@example.org') for u in synced],
+        batch_size=4
+    )
+    assert all(
+        u.email.endswith('.org')
+        for u in users_repo.filter(User.username.startswith('user')).all()
+    )
+    users_repo.update(synced[1].id, email='one@example.com')
+    assert users_repo.get_by_id(synced[1].id).email == 'one@example.com'
+    users_repo.filter(username='user0').update_all(email='zero@example.com')
+    assert users_repo.filter(email='zero@example.com').count() == 1
+
     with Session(engine) as session:
         assert users_repo(session).all()
+        # Repeated lookups in a session come from the identity map
+        user = users_repo(session).get_by_id(users[0].id)
+        assert users_repo(session).get_by_id(users[0].id) is user
 
     users[0].username = '1'
-    users_repo.save_or_update(users[0])
+    saved = users_repo.save_or_update(users[0])
+    assert saved.id == users[0].id
+    # Only changed fields are written, the stale email is not saved
+    assert saved.email != users[0].email
+    assert users_repo.get_by_id(users[0].id).username == '1'
+
+    # Nothing changed on a freshly loaded record
+    unchanged = users_repo.get_by_id(users[0].id)
+    assert users_repo.save_or_update(unchanged).username == '1'
+
+    new_user = User(username='dave', email='dave@example.com')
+    saved = users_repo.save_or_update(new_user)
+    assert new_user.id == saved.id
+    assert users_repo.get_by_id(new_user.id).username == 'dave'
+    new_user.username = 'david'
+    users_repo.save(new_user)
+    assert users_repo.get_by_id(new_user.id).username == 'david'
+    users_repo.delete(users_repo.save_or_update(
+        User(username='erin', email='erin@example.com')
+    ))
+    assert not users_repo.filter(username='erin').count()
+
+    users_repo.update_or_404(new_user.id, email='dave@example.org')
+    assert users_repo.get_by_id(new_user.id).email == 'dave@example.org'
+    users_repo.delete_or_404(new_user.id)
+    assert users_repo.get_by_id(new_user.id) is None
 
     users_repo.delete_all()
 
@@ -109,5 +286,153 @@ def test_all():
     assert not users
 
 
+def test_related():
+    teams_repo = SQLModelRepo(model=Team, db_engine=engine)
+    members_repo = SQLModelRepo(model=Member, db_engine=engine)
+    team = teams_repo.create(name='red')
+    members_repo.bulk_create(
+        [dict(name=f'member{i}', team_id=team.id) for i in range(3)]
+    )
+
+    assert members_repo.filter(team=team).count() == 3
+    with pytest.raises(AttributeError, match='nickname'):
+        members_repo.filter(nickname='x')
+
+    teams = teams_repo.with_related('members').all()
+    assert len(teams[0].members) == 3
+    teams = teams_repo.options(joinedload(Team.members)).all()
+    assert len(teams) == 1
+    assert len(teams[0].members) == 3
+    teams, _ = teams_repo.options(
+        joinedload(Team.members)
+    ).paginate_after(None, 1, order_by='id')
+    assert len(teams[0].members) == 3
+
+    # Repos without a WHERE clause affect all records
+    members_repo.with_related('team').update_all(name='member')
+    assert members_repo.filter(name='member').count() == 3
+    members_repo.filter().delete_all()
+    assert members_repo.count() == 0
+
+    with Session(engine) as session:
+        teams = teams_repo(session).strict_relations().all()
+        with pytest.raises(InvalidRequestError, match="lazy='raise'"):
+            teams[0].members
+
+
+def test_custom_primary_key():
+    settings_repo = SQLModelRepo(model=Setting, db_engine=engine)
+    settings_repo.create(key='theme', value='dark')
+    assert settings_repo.insert(key='lang', value='en') == 'lang'
+    with pytest.raises(CompileError, match='valeu'):
+        settings_repo.insert(key='font', valeu='mono')
+    assert settings_repo.get_by_id('font') is None
+
+    assert settings_repo.get_by_id('theme').value == 'dark'
+    settings_repo.update('theme', value='light')
+    settings_repo.update_or_404('lang', value='de')
+    lang = Setting(key='lang', value='fr')
+    assert settings_repo.save_or_update(lang) is lang
+    lang.value = 'es'
+    settings_repo.save(lang)
+    assert settings_repo.get_by_id('lang').value == 'es'
+    settings_repo.delete(lang)
+    settings_repo.save_or_update(Setting(key='lang', value='fr'))
+    with Session(engine) as session:
+        theme = Setting(key='theme', value='light')
+        settings_repo(session).save_or_update(theme)
+        theme.value = 'blue'
+        settings_repo(session).save(theme)
+    assert settings_repo.get_by_id('theme').value == 'blue'
+
+    # A record already held by the session is updated in place
+    with Session(engine) as session:
+        loaded = settings_repo(session).get_by_id('theme')
+        saved = settings_repo(session).save_or_update(
+            Setting(key='theme', value='green')
+        )
+        assert saved is loaded and loaded in session
+        assert loaded.value == 'green'
+        loaded.value = 'later'
+        session.commit()
+    assert settings_repo.get_by_id('theme').value == 'later'
+    settings_repo.update('theme', value='light')
+    assert [s.value for s in settings_repo.paginate(
+        0, 2, order_by='key', deferred_join=True
+    )] == ['fr', 'light']
+
+
+def test_update():
+    codes_repo = SQLModelRepo(model=Code, db_engine=engine)
+    code = codes_repo.create(pk=1, name='a')
+    codes_repo.update(code.id, pk=2)
+    assert codes_repo.get_by_id(code.id).pk == 2
+
+    # Objects loaded in the session see the update
+    with Session(engine, expire_on_commit=False) as session:
+        loaded = codes_repo(session).get_by_id(code.id)
+        codes_repo(session).update(code.id, name='new')
+        assert loaded.name == 'new'
+
+
+def test_upsert_onupdate():
+    notes_repo = SQLModelRepo(model=Note, db_engine=engine)
+    note = notes_repo.create(text='draft')
+    assert note.revision is None
+    saved = notes_repo.save_or_update(Note(id=note.id, text='final'))
+    assert saved.revision == 'edited'
+    assert saved.edited_at is not None
+
+    # Callable onupdate values are left to the ORM
+    stamps_repo = SQLModelRepo(model=Stamp, db_engine=engine)
+    stamp = stamps_repo.create(text='draft')
+    saved = stamps_repo.save_or_update(Stamp(id=stamp.id, text='final'))
+    assert saved.text == 'final'
+    assert saved.edited_at is not None
+
+
+def test_composite_primary_key():
+    pairs_repo = SQLModelRepo(model=Pair, db_engine=engine)
+    pairs_repo.create(a=1, b=1, value='x')
+    assert pairs_repo.insert(a=1, b=2, value='y') == (1, 2)
+    pairs_repo.bulk_create([dict(a=2, b=1, value='z')])
+
+    assert pairs_repo.count() == 3
+    assert len(pairs_repo.filter(a=1).all()) == 2
+    assert [p.value for p in pairs_repo.paginate(
+        1, 2, order_by='value'
+    )] == ['y', 'z']
+    pairs_repo.filter(a=2).update_all(value='w')
+    assert pairs_repo.filter(value='w').count() == 1
+
+    # Lookups and writes by id match a single column only
+    with pytest.raises(ValueError, match='single-column primary key'):
+        pairs_repo.get_by_id(1)
+    with pytest.raises(ValueError, match='single-column primary key'):
+        pairs_repo.update(1, value='v')
+    assert pairs_repo.filter(a=1).count() == 2
+
+    pairs_repo.delete(pairs_repo.filter(a=1, b=1).first())
+    pairs_repo.filter(a=1).delete_all()
+    assert [(p.a, p.b) for p in pairs_repo.all()] == [(2, 1)]
+
+
+def test_create_repo_engine():
+    file_engine = create_repo_engine("sqlite:///file.db")
+    assert file_engine.pool._pre_ping
+    assert file_engine.pool._pool.use_lifo
+
+
+def test_engine_not_retained():
+    temp_engine = create_repo_engine("sqlite:///:memory:")
+    SQLModel.metadata.create_all(temp_engine)
+    SQLModelRepo(model=User, db_engine=temp_engine).all()
+    engine_ref = weakref.ref(temp_engine)
+    temp_engine.dispose()
+    del temp_engine
+    gc.collect()
+    assert engine_ref() is None
+
+
 if __name__ == '__main__':
     test_all()